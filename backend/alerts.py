@@ -0,0 +1,80 @@
+import sqlite3
+from typing import Optional
+
+# Price alerts evaluated inside the quote write path (ingest and /watchlist/{symbol}/refresh).
+# Alerts fire when the price crosses the threshold between the previous stored quote and
+# the new one, not while the condition merely holds:
+#   above    -> previous price < threshold <= current price
+#   below    -> previous price > threshold >= current price
+#   pct_up   -> the move vs previous_close crosses +threshold % upwards
+#   pct_down -> the move vs previous_close crosses -threshold % downwards
+# Unchanged quotes (e.g. while the market is closed) therefore never fire. `active` only
+# switches a rule on or off.
+
+ALERT_KINDS = ("above", "below", "pct_up", "pct_down")
+
+
+def latest_price(conn: sqlite3.Connection, symbol: str) -> Optional[float]:
+    # Read before quotes_latest is overwritten, inside the same transaction
+    row = conn.execute("SELECT current_price FROM quotes_latest WHERE symbol = ?", (symbol,)).fetchone()
+    return row[0] if row else None
+
+
+def evaluate_alerts(
+    conn: sqlite3.Connection,
+    symbol: str,
+    prev_price: Optional[float],
+    current_price: Optional[float],
+    previous_close: Optional[float],
+    quote_ts: Optional[int],
+) -> list[dict]:
+    # Without a previous price there is no crossing to detect yet
+    if current_price is None or prev_price is None or current_price == prev_price:
+        return []
+
+    # Each check is a bounded range seek on idx_alerts_active (symbol, kind, threshold),
+    # so only this symbol's rules that actually fire are read
+    checks = [
+        ("above", "threshold > ? AND threshold <= ?", prev_price, current_price),
+        ("below", "threshold < ? AND threshold >= ?", prev_price, current_price),
+    ]
+    pct = None
+    if previous_close:
+        pct = (current_price - previous_close) / previous_close * 100.0
+        prev_pct = (prev_price - previous_close) / previous_close * 100.0
+        checks += [
+            ("pct_up", "threshold > ? AND threshold <= ?", prev_pct, pct),
+            # pct_down thresholds are magnitudes of the drop
+            ("pct_down", "threshold > ? AND threshold <= ?", -prev_pct, -pct),
+        ]
+
+    fired = []
+    for kind, cond, low, high in checks:
+        rows = conn.execute(
+            f"""
+            SELECT id, threshold
+            FROM alerts
+            WHERE symbol = ? AND kind = ? AND active = 1 AND {cond}
+            """,
+            (symbol, kind, low, high),
+        ).fetchall()
+        fired += [
+            {"alert_id": r[0], "symbol": symbol, "kind": kind, "threshold": r[1], "price": current_price, "pct_change": pct, "quote_ts": quote_ts}
+            for r in rows
+        ]
+
+    if not fired:
+        return fired
+
+    conn.executemany(
+        """
+        INSERT INTO alert_events(alert_id, symbol, kind, threshold, price, pct_change, quote_ts, fired_at)
+        VALUES (:alert_id, :symbol, :kind, :threshold, :price, :pct_change, :quote_ts, CURRENT_TIMESTAMP)
+        """,
+        fired,
+    )
+    conn.executemany(
+        "UPDATE alerts SET triggered_at = CURRENT_TIMESTAMP WHERE id = ?",
+        [(e["alert_id"],) for e in fired],
+    )
+    return fired
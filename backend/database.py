@@ -62,6 +62,53 @@ def create_database(db_name="finnhub_data.db"):
         ON quotes_history(symbol, collected_ts)
     ''')
 
+    # Price alerts, evaluated by ingest for every new quote (see alerts.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        symbol TEXT NOT NULL,
+        kind TEXT NOT NULL,      -- above | below | pct_up | pct_down
+        threshold REAL NOT NULL,
+        active INTEGER NOT NULL DEFAULT 1,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        triggered_at DATETIME,
+        FOREIGN KEY (symbol) REFERENCES stocks(symbol)
+        )
+    ''')
+
+    # Only active rules are indexed, sorted by threshold per (symbol, kind)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_alerts_active
+        ON alerts(symbol, kind, threshold)
+        WHERE active = 1
+    ''')
+
+    # Fired alerts; id is the cursor for /alerts/events
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alert_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        alert_id INTEGER,
+        symbol TEXT,
+        kind TEXT,
+        threshold REAL,
+        price REAL,
+        pct_change REAL,
+        quote_ts INTEGER,
+        fired_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Shared Finnhub quota state (token bucket + circuit breaker), see quota.py
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS api_quota (
+        name TEXT PRIMARY KEY,
+        tokens REAL,
+        refilled_at REAL,
+        blocked_until REAL DEFAULT 0,
+        failures INTEGER DEFAULT 0
+        )
+    ''')
+
     conn.commit()
     conn.close()
     print(f"Baza de date '{db_name}' a fost creată cu succes!")
@@ -8,7 +8,9 @@ from datetime import datetime, timezone
 import finnhub
 from dotenv import load_dotenv
 
+from alerts import evaluate_alerts, latest_price
 from database import create_database
+from quota import QuotaCoordinator, fetch_with_retry
 
 # Script that fetches and parses information from the Finnhub API and sends it to the Sqlite db
 
@@ -18,7 +20,7 @@ def parse_symbols(value: str) -> list[str]:
 
 # This function takes the parsed symbols with the information from the APIs and inserts tge data in the db
 
-def upsert_learned_data(conn: sqlite3.Connection, symbol: str, profile: dict, quote: dict) -> None:
+def upsert_learned_data(conn: sqlite3.Connection, symbol: str, profile: dict, quote: dict) -> list[dict]:
     name = profile.get("name")
     currency = profile.get("currency")
     exchange = profile.get("exchange")
@@ -50,6 +52,8 @@ def upsert_learned_data(conn: sqlite3.Connection, symbol: str, profile: dict, qu
         (symbol, name, currency, exchange, industry),
     )
 
+    prev_price = latest_price(conn, symbol)
+
     cur.execute(
         """
         INSERT INTO quotes_latest(
@@ -78,18 +82,9 @@ def upsert_learned_data(conn: sqlite3.Connection, symbol: str, profile: dict, qu
         (symbol, collected_ts, quote_ts, current_price, high_price, low_price, open_price, previous_close),
     )
 
+    # same transaction as the quote, so a rolled back tick does not fire alerts
+    return evaluate_alerts(conn, symbol, prev_price, current_price, previous_close, quote_ts)
 
-def fetch_with_retry(fn, *, retries: int, base_sleep_s: float):
-    last_exc = None
-    for attempt in range(retries + 1):
-        try:
-            return fn()
-        except Exception as e:
-            last_exc = e
-            if attempt == retries:
-                break
-            time.sleep(base_sleep_s * (2 ** attempt))
-    raise last_exc
 
 # Reads from the db for /watchlist
 def read_watchlist_symbols(db_path: str) -> list[str]:
@@ -135,6 +130,7 @@ def main():
     # asigură schema (inclusiv watchlist)
     create_database(db_path)
     client = finnhub.Client(api_key=api_key)
+    quota = QuotaCoordinator(db_path)
 
 
     while True:
@@ -165,21 +161,23 @@ def main():
             for sym in symbols:
                 try:
                     profile = fetch_with_retry(
+                        quota,
                         lambda: client.company_profile2(symbol=sym) or {},
                         retries=args.retries,
                         base_sleep_s=1.0,
                     )
                     quote = fetch_with_retry(
+                        quota,
                         lambda: client.quote(sym) or {},
                         retries=args.retries,
                         base_sleep_s=1.0,
                     )
 
                     conn.execute("BEGIN;")
-                    upsert_learned_data(conn, sym, profile, quote)
+                    fired = upsert_learned_data(conn, sym, profile, quote)
                     conn.commit()
 
-                    summary["ok"].append({"symbol": sym, "quote_ts": quote.get("t")})
+                    summary["ok"].append({"symbol": sym, "quote_ts": quote.get("t"), "alerts_fired": len(fired)})
                 except Exception as e:
                     try:
                         conn.rollback()
@@ -1,4 +1,7 @@
 import os
+import json
+import math
+import time
 import sqlite3
 from typing import Optional
 
@@ -7,7 +10,9 @@ from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 
+from alerts import ALERT_KINDS, evaluate_alerts, latest_price
 from database import create_database
+from quota import INTERACTIVE, QuotaCoordinator, QuotaUnavailable, error_retry_after, error_status, fetch_with_retry
 
 load_dotenv()
 
@@ -22,6 +27,8 @@ def parse_symbols(value: Optional[str]) -> list[str]:
 
 WATCHLIST_SYMBOLS = parse_symbols(os.environ.get("SYMBOLS"))
 WATCHLIST_MAX = int(os.environ.get("WATCHLIST_MAX", "100"))
+# How long an interactive request may wait for Finnhub quota before giving up
+FINNHUB_INTERACTIVE_MAX_WAIT = float(os.environ.get("FINNHUB_INTERACTIVE_MAX_WAIT", "5"))
 
 
 API_KEY = os.environ.get("FINNHUB_API_KEY")
@@ -29,6 +36,7 @@ if not API_KEY:
     raise RuntimeError("Missing FINNHUB_API_KEY (set it in env or .env)")
 
 client = finnhub.Client(api_key=API_KEY)
+quota = QuotaCoordinator(DB_PATH)
 
 app = FastAPI(title="Finnhub -> SQLite API")
 
@@ -55,6 +63,31 @@ def get_conn():
     conn.execute("PRAGMA foreign_keys = ON;")
     return conn
 
+def finnhub_call(fn):
+    # Interactive calls jump ahead of the ingest worker but never wait long for quota
+    try:
+        return fetch_with_retry(
+            quota,
+            fn,
+            retries=0,
+            base_sleep_s=1.0,
+            priority=INTERACTIVE,
+            max_wait_s=FINNHUB_INTERACTIVE_MAX_WAIT,
+        )
+    except QuotaUnavailable as e:
+        raise quota_busy(e.retry_after)
+    except Exception as e:
+        if error_status(e) == 429:
+            raise quota_busy(error_retry_after(e) or 1.0)
+        raise HTTPException(status_code=502, detail=f"Finnhub error: {repr(e)}")
+
+def quota_busy(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Finnhub quota busy, try again later.",
+        headers={"Retry-After": str(int(retry_after) + 1)},
+    )
+
 def normalize_symbol(symbol: str) -> str:
     return symbol.strip().upper()
 
@@ -246,6 +279,97 @@ def quote_history(symbol: str, limit: int = 200):
     finally:
         conn.close()
 
+# Sparklines for many symbols in one round trip: the last `window_s` seconds are split into
+# `points` equal time buckets (averaged price, last collected_ts of the bucket). Rows are read
+# through a range seek on (symbol, collected_ts) and aggregated directly, without a sort.
+HISTORY_BATCH_MAX_WINDOW_S = 90 * 86400
+
+@app.get("/quotes/history")
+def quotes_history_batch(symbols: Optional[str] = None, points: int = 50, window_s: int = 86400):
+    if points < 2 or points > 1000:
+        raise HTTPException(status_code=400, detail="points must be between 2 and 1000.")
+    if window_s < 1 or window_s > HISTORY_BATCH_MAX_WINDOW_S:
+        raise HTTPException(status_code=400, detail=f"window_s must be between 1 and {HISTORY_BATCH_MAX_WINDOW_S}.")
+
+    conn = get_conn()
+    try:
+        requested = parse_symbols(symbols)
+        if not requested:
+            requested = db_watchlist_symbols(conn)
+        if not requested:
+            return {}
+
+        start_ts = int(time.time()) - window_s
+        rows = conn.execute(
+            """
+            WITH req(symbol) AS (
+              SELECT value FROM json_each(:symbols)
+            )
+            SELECT
+              h.symbol,
+              MIN(:points - 1, (h.collected_ts - :start_ts) * :points / :window_s) AS bucket,
+              MAX(h.collected_ts) AS collected_ts,
+              AVG(h.current_price) AS current_price
+            FROM req
+            JOIN quotes_history h ON h.symbol = req.symbol AND h.collected_ts >= :start_ts
+            GROUP BY h.symbol, bucket
+            ORDER BY h.symbol, bucket
+            """,
+            {"symbols": json.dumps(requested), "points": points, "start_ts": start_ts, "window_s": window_s},
+        ).fetchall()
+
+        out = {sym: [] for sym in requested}
+        for r in rows:
+            out[r["symbol"]].append({"collected_ts": r["collected_ts"], "current_price": r["current_price"]})
+        return out
+    finally:
+        conn.close()
+
+# Last known quote of each symbol at timestamp `ts` (used for trade reconciliation).
+# Each symbol is resolved by a seek on the (symbol, collected_ts) primary key, so the
+# cost grows with the number of symbols, not with the size of the history.
+@app.get("/quotes/asof")
+def quotes_asof(ts: int, symbols: Optional[str] = None):
+    conn = get_conn()
+    try:
+        requested = parse_symbols(symbols)
+        if not requested:
+            requested = db_watchlist_symbols(conn)
+        if not requested:
+            return []
+
+        rows = conn.execute(
+            """
+            WITH req(symbol, ord) AS (
+              SELECT value, key FROM json_each(?)
+            )
+            SELECT
+              req.symbol,
+              h.collected_ts,
+              h.quote_ts,
+              h.current_price,
+              h.high_price,
+              h.low_price,
+              h.open_price,
+              h.previous_close
+            FROM req
+            LEFT JOIN quotes_history h
+              ON h.symbol = req.symbol
+             AND h.collected_ts = (
+                   SELECT collected_ts
+                   FROM quotes_history
+                   WHERE symbol = req.symbol AND collected_ts <= ?
+                   ORDER BY collected_ts DESC
+                   LIMIT 1
+                 )
+            ORDER BY req.ord
+            """,
+            (json.dumps(requested), ts),
+        ).fetchall()
+        return [dict(r) for r in rows]
+    finally:
+        conn.close()
+
 # ---------------------------------------------------------
 # Backend endpoints for watchlist
 @app.get("/watchlist")
@@ -293,11 +417,8 @@ def refresh_symbol(symbol: str):
     if not symbol:
         raise HTTPException(status_code=400, detail="Empty symbol")
 
-    try:
-        profile = client.company_profile2(symbol=symbol) or {}
-        quote = client.quote(symbol) or {}
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=f"Finnhub error: {repr(e)}")
+    profile = finnhub_call(lambda: client.company_profile2(symbol=symbol) or {})
+    quote = finnhub_call(lambda: client.quote(symbol) or {})
 
     quote_ts = quote.get("t")
     if quote_ts is None:
@@ -330,6 +451,8 @@ def refresh_symbol(symbol: str):
             (symbol, name, currency, exchange, industry),
         )
 
+        prev_price = latest_price(conn, symbol)
+
         conn.execute(
             """
             INSERT INTO quotes_latest(symbol, current_price, high_price, low_price, open_price, previous_close, quote_ts, updated_at)
@@ -346,8 +469,10 @@ def refresh_symbol(symbol: str):
             (symbol, current_price, high_price, low_price, open_price, previous_close, quote_ts),
         )
 
+        fired = evaluate_alerts(conn, symbol, prev_price, current_price, previous_close, quote_ts)
+
         conn.commit()
-        return {"ok": True, "symbol": symbol, "quote_ts": quote_ts}
+        return {"ok": True, "symbol": symbol, "quote_ts": quote_ts, "alerts_fired": len(fired)}
     finally:
         conn.close()
 
@@ -359,6 +484,7 @@ def watchlist_purge(symbol: str):
         conn.execute("BEGIN;")
 
         h = conn.execute("DELETE FROM quotes_history WHERE symbol = ?", (symbol,)).rowcount
+        a = conn.execute("DELETE FROM alerts WHERE symbol = ?", (symbol,)).rowcount
         q = conn.execute("DELETE FROM quotes_latest WHERE symbol = ?", (symbol,)).rowcount
         w = conn.execute("DELETE FROM watchlist WHERE symbol = ?", (symbol,)).rowcount
         s = conn.execute("DELETE FROM stocks WHERE symbol = ?", (symbol,)).rowcount
@@ -367,7 +493,7 @@ def watchlist_purge(symbol: str):
         return {
             "ok": True,
             "symbol": symbol,
-            "deleted": {"quotes_history": h, "quotes_latest": q, "watchlist": w, "stocks": s},
+            "deleted": {"quotes_history": h, "alerts": a, "quotes_latest": q, "watchlist": w, "stocks": s},
         }
     except Exception:
         conn.rollback()
@@ -400,9 +526,140 @@ def search(query: str):
     if len(q) < 2:
         raise HTTPException(status_code=400, detail="Query too short (min 2 chars).")
 
+    return finnhub_call(lambda: client.symbol_lookup(q))
+
+# ---------------------------------------------------------
+# Backend endpoints for alerts (evaluated by ingest, see alerts.py)
+
+ALERT_COLUMNS = "id, symbol, kind, threshold, active, created_at, triggered_at"
+ALERTS_MAX_LIMIT = 1000
+
+def validate_threshold(kind: str, threshold: float) -> None:
+    if not math.isfinite(threshold):
+        raise HTTPException(status_code=400, detail="threshold must be a finite number.")
+    # pct_* thresholds are magnitudes; a negative one would fire on almost every tick
+    if kind in ("pct_up", "pct_down") and threshold < 0:
+        raise HTTPException(status_code=400, detail="threshold must be >= 0 for pct_up/pct_down.")
+
+def validate_limit(limit: int) -> None:
+    if limit < 1 or limit > ALERTS_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {ALERTS_MAX_LIMIT}.")
+
+@app.get("/alerts")
+def list_alerts(symbol: Optional[str] = None, active: Optional[bool] = None, limit: int = 1000, offset: int = 0):
+    validate_limit(limit)
+    symbol = normalize_symbol(symbol) if symbol else None
+    conn = get_conn()
     try:
-        return client.symbol_lookup(q)
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=f"Finnhub error: {repr(e)}")
+        rows = conn.execute(
+            f"""
+            SELECT {ALERT_COLUMNS}
+            FROM alerts
+            WHERE (? IS NULL OR symbol = ?) AND (? IS NULL OR active = ?)
+            ORDER BY id
+            LIMIT ? OFFSET ?
+            """,
+            (symbol, symbol, active, active, limit, offset),
+        ).fetchall()
+        return [dict(r) for r in rows]
+    finally:
+        conn.close()
+
+
+@app.post("/alerts")
+def create_alert(symbol: str, kind: str, threshold: float):
+    symbol = normalize_symbol(symbol)
+    if kind not in ALERT_KINDS:
+        raise HTTPException(status_code=400, detail=f"Invalid kind, expected one of: {', '.join(ALERT_KINDS)}")
+    validate_threshold(kind, threshold)
+
+    conn = get_conn()
+    try:
+        in_watchlist = conn.execute("SELECT 1 FROM watchlist WHERE symbol = ?", (symbol,)).fetchone()
+        if not in_watchlist:
+            raise HTTPException(status_code=400, detail="Symbol not in watchlist.")
+
+        cur = conn.execute(
+            "INSERT INTO alerts(symbol, kind, threshold, active, created_at) VALUES (?, ?, ?, 1, CURRENT_TIMESTAMP)",
+            (symbol, kind, threshold),
+        )
+        conn.commit()
+        row = conn.execute(f"SELECT {ALERT_COLUMNS} FROM alerts WHERE id = ?", (cur.lastrowid,)).fetchone()
+        return dict(row)
+    finally:
+        conn.close()
+
+# Cursor-based feed of fired alerts: pass the returned next_cursor as `after` on the next call
+@app.get("/alerts/events")
+def alert_events(after: int = 0, limit: int = 100, symbol: Optional[str] = None):
+    validate_limit(limit)
+    symbol = normalize_symbol(symbol) if symbol else None
+    conn = get_conn()
+    try:
+        rows = conn.execute(
+            """
+            SELECT id, alert_id, symbol, kind, threshold, price, pct_change, quote_ts, fired_at
+            FROM alert_events
+            WHERE id > ? AND (? IS NULL OR symbol = ?)
+            ORDER BY id
+            LIMIT ?
+            """,
+            (after, symbol, symbol, limit),
+        ).fetchall()
+        events = [dict(r) for r in rows]
+        return {"events": events, "next_cursor": events[-1]["id"] if events else after}
+    finally:
+        conn.close()
 
 
+@app.get("/alerts/{alert_id}")
+def get_alert(alert_id: int):
+    conn = get_conn()
+    try:
+        row = conn.execute(f"SELECT {ALERT_COLUMNS} FROM alerts WHERE id = ?", (alert_id,)).fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Alert not found.")
+        return dict(row)
+    finally:
+        conn.close()
+
+# Updates the threshold and/or switches the alert on or off
+@app.put("/alerts/{alert_id}")
+def update_alert(alert_id: int, threshold: Optional[float] = None, active: Optional[bool] = None):
+    conn = get_conn()
+    try:
+        if threshold is not None:
+            row = conn.execute("SELECT kind FROM alerts WHERE id = ?", (alert_id,)).fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="Alert not found.")
+            validate_threshold(row["kind"], threshold)
+
+        cur = conn.execute(
+            """
+            UPDATE alerts
+            SET threshold = COALESCE(?, threshold),
+                active = COALESCE(?, active)
+            WHERE id = ?
+            """,
+            (threshold, active, alert_id),
+        )
+        if cur.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Alert not found.")
+        conn.commit()
+        row = conn.execute(f"SELECT {ALERT_COLUMNS} FROM alerts WHERE id = ?", (alert_id,)).fetchone()
+        return dict(row)
+    finally:
+        conn.close()
+
+
+@app.delete("/alerts/{alert_id}")
+def delete_alert(alert_id: int):
+    conn = get_conn()
+    try:
+        n = conn.execute("DELETE FROM alerts WHERE id = ?", (alert_id,)).rowcount
+        if n == 0:
+            raise HTTPException(status_code=404, detail="Alert not found.")
+        conn.commit()
+        return {"ok": True, "id": alert_id}
+    finally:
+        conn.close()
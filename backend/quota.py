@@ -0,0 +1,228 @@
+import os
+import time
+import sqlite3
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+# Coordinates the Finnhub API key between every process that uses it (ingest worker,
+# /watchlist/{symbol}/refresh, /search). The state lives in the shared SQLite db, so the
+# containers that mount the same volume see the same token bucket and circuit breaker.
+
+# After an idle period (e.g. between ingest rounds) a full bucket plus one minute of refill
+# can be spent within a single minute, so keep FINNHUB_BURST + FINNHUB_CALLS_PER_MIN at or
+# below Finnhub's real per-minute limit (60 on the free tier).
+FINNHUB_CALLS_PER_MIN = float(os.environ.get("FINNHUB_CALLS_PER_MIN", "50"))
+FINNHUB_BURST = float(os.environ.get("FINNHUB_BURST", "10"))
+# Tokens that background callers (ingest) are not allowed to take, kept for interactive requests
+FINNHUB_INTERACTIVE_RESERVE = float(os.environ.get("FINNHUB_INTERACTIVE_RESERVE", "5"))
+FINNHUB_BREAKER_THRESHOLD = int(os.environ.get("FINNHUB_BREAKER_THRESHOLD", "5"))
+FINNHUB_BREAKER_COOLDOWN = float(os.environ.get("FINNHUB_BREAKER_COOLDOWN", "60"))
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+
+class QuotaUnavailable(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Finnhub quota unavailable, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class QuotaCoordinator:
+    def __init__(
+        self,
+        db_path: str,
+        name: str = "finnhub",
+        calls_per_min: float = FINNHUB_CALLS_PER_MIN,
+        burst: float = FINNHUB_BURST,
+        interactive_reserve: float = FINNHUB_INTERACTIVE_RESERVE,
+        breaker_threshold: int = FINNHUB_BREAKER_THRESHOLD,
+        breaker_cooldown: float = FINNHUB_BREAKER_COOLDOWN,
+    ):
+        self.db_path = db_path
+        self.name = name
+        self.rate_per_s = calls_per_min / 60.0
+        self.burst = burst
+        self.interactive_reserve = min(interactive_reserve, burst - 1)
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit mode, so BEGIN IMMEDIATE below takes the write lock up front
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _load(self, conn: sqlite3.Connection, now: float) -> sqlite3.Row:
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO api_quota(name, tokens, refilled_at, blocked_until, failures)
+            VALUES (?, ?, ?, 0, 0)
+            """,
+            (self.name, self.burst, now),
+        )
+        return conn.execute(
+            "SELECT tokens, refilled_at, blocked_until, failures FROM api_quota WHERE name = ?",
+            (self.name,),
+        ).fetchone()
+
+    def _try_take(self, priority: str) -> tuple[float, int]:
+        """Takes one token if possible. Returns (seconds to wait or 0 on success, failures seen)."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE;")
+            now = time.time()
+            row = self._load(conn, now)
+
+            tokens = min(self.burst, row["tokens"] + max(0.0, now - row["refilled_at"]) * self.rate_per_s)
+            blocked_until = row["blocked_until"]
+            wait = 0.0
+
+            if blocked_until > now:
+                wait = blocked_until - now
+            else:
+                floor = 0.0 if priority == INTERACTIVE else self.interactive_reserve
+                if tokens >= floor + 1:
+                    tokens -= 1
+                    # Half-open breaker: let a single probe through and hold everyone else
+                    # until it reports back
+                    if row["failures"] >= self.breaker_threshold:
+                        blocked_until = now + self.breaker_cooldown
+                else:
+                    wait = (floor + 1 - tokens) / self.rate_per_s
+
+            conn.execute(
+                "UPDATE api_quota SET tokens = ?, refilled_at = ?, blocked_until = ? WHERE name = ?",
+                (tokens, now, blocked_until, self.name),
+            )
+            conn.execute("COMMIT;")
+            return wait, row["failures"]
+        except Exception:
+            # BEGIN IMMEDIATE itself may have failed (database is locked)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK;")
+            raise
+        finally:
+            conn.close()
+
+    def acquire(self, priority: str = BACKGROUND, max_wait_s: Optional[float] = None) -> int:
+        """Blocks until a token is taken. Returns the failure count seen when it was taken."""
+        deadline = None if max_wait_s is None else time.monotonic() + max_wait_s
+        while True:
+            wait, failures = self._try_take(priority)
+            if wait <= 0:
+                return failures
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise QuotaUnavailable(wait)
+            # re-check periodically, another process may have changed the state
+            time.sleep(min(wait, 1.0))
+
+    def record_success(self) -> None:
+        conn = self._connect()
+        try:
+            # closes the breaker; a Retry-After pause set by another process stays in place
+            conn.execute(
+                """
+                UPDATE api_quota
+                SET failures = 0,
+                    blocked_until = CASE WHEN failures >= ? THEN 0 ELSE blocked_until END
+                WHERE name = ? AND failures > 0
+                """,
+                (self.breaker_threshold, self.name),
+            )
+        finally:
+            conn.close()
+
+    def record_failure(self, retry_after: Optional[float] = None) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE;")
+            now = time.time()
+            row = self._load(conn, now)
+
+            failures = row["failures"] + 1
+            until = now + retry_after if retry_after else 0.0
+            if failures >= self.breaker_threshold:
+                until = max(until, now + self.breaker_cooldown)
+
+            conn.execute(
+                "UPDATE api_quota SET failures = ?, blocked_until = ? WHERE name = ?",
+                (failures, max(row["blocked_until"], until), self.name),
+            )
+            conn.execute("COMMIT;")
+        except Exception:
+            # BEGIN IMMEDIATE itself may have failed (database is locked)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK;")
+            raise
+        finally:
+            conn.close()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def error_status(exc: Exception) -> Optional[int]:
+    # finnhub.FinnhubAPIException keeps the HTTP status and the requests response
+    status = getattr(exc, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def error_retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    return parse_retry_after(headers.get("Retry-After"))
+
+
+def fetch_with_retry(
+    quota: QuotaCoordinator,
+    fn,
+    *,
+    retries: int,
+    base_sleep_s: float,
+    priority: str = BACKGROUND,
+    max_wait_s: Optional[float] = None,
+):
+    last_exc = None
+    for attempt in range(retries + 1):
+        failures = quota.acquire(priority, max_wait_s=max_wait_s)
+        try:
+            result = fn()
+        except Exception as e:
+            last_exc = e
+            status = error_status(e)
+            backoff = base_sleep_s * (2 ** attempt)
+
+            if status == 429:
+                # shared pause: every process waits, not only this one
+                quota.record_failure(error_retry_after(e) or backoff)
+            elif status is not None and status < 500:
+                # client error (bad symbol, bad key): retrying will not help, but Finnhub
+                # answered, so a half-open breaker can close again
+                if failures:
+                    quota.record_success()
+                raise
+            else:
+                quota.record_failure()
+                if attempt < retries:
+                    time.sleep(backoff)
+
+            if attempt == retries:
+                break
+            continue
+
+        # skip the write when there was nothing to reset
+        if failures:
+            quota.record_success()
+        return result
+    raise last_exc
@@ -43,6 +43,14 @@ export const api = {
     getJson<{ collected_ts: number; current_price: number | null }[]>(
       `/quotes/history/${encodeURIComponent(symbol)}?limit=${limit}`
     ),
+  quoteHistoryBatch: (symbols: string[], points = 50, windowS = 86400) =>
+    getJson<
+      Record<string, { collected_ts: number; current_price: number | null }[]>
+    >(
+      `/quotes/history?symbols=${encodeURIComponent(
+        symbols.join(",")
+      )}&points=${points}&window_s=${windowS}`
+    ),
 
   search: (query: string) =>
     getJson<any>(`/search?query=${encodeURIComponent(query)}`),